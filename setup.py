@@ -13,7 +13,8 @@ with open(path.join(here, 'README.md'), encoding='utf-8') as f:
     long_description = f.read()
     parts = long_description.split("](")
     for idx in range(1, len(parts)):
-        parts[idx] = OFFICIAL_DOC_URL + parts[idx]
+        if not parts[idx].startswith("http"):
+            parts[idx] = OFFICIAL_DOC_URL + parts[idx]
     long_description = "](".join(parts)
 
 # get the dependencies and installs
@@ -44,7 +45,9 @@ setup(
     install_requires=install_requires,
     dependency_links=dependency_links,
     author_email='mail@michaelfuerst.de',
-    extras_require={},
+    extras_require={
+        'fast': ['simplejpeg'],
+    },
     entry_points={
         'console_scripts': [
             'md_embed_images = simple_md.embed_images:main',
@@ -1,7 +1,21 @@
 from typing import List, Any
+from collections import OrderedDict, deque
+from concurrent.futures import ThreadPoolExecutor
+import base64
+import hashlib
+import os
+import re
+import threading
+import cv2
+import imageio
 import numpy as np
 import matplotlib.pyplot as plt
 
+try:
+    import simplejpeg
+except ImportError:
+    simplejpeg = None
+
 
 DEFAULT_STYLE = """
 body {
@@ -116,6 +130,161 @@ tbody tr:last-of-type {
 """
 
 
+def minify_css(css: str) -> str:
+    """
+    Collapse all whitespace in a css string into single spaces.
+    """
+    return re.sub(r"\s+", " ", css)
+
+
+DEFAULT_STYLE_MIN = minify_css(DEFAULT_STYLE)
+
+
+_SIMPLEJPEG_COLORSPACES = {
+    (1, False): "GRAY", (1, True): "GRAY",
+    (3, False): "RGB", (3, True): "BGR",
+    (4, False): "RGBA", (4, True): "BGRA",
+}
+
+
+def _swap_red_blue(image: np.ndarray, keep_alpha: bool = True) -> np.ndarray:
+    """
+    Convert between RGB(A) and BGR(A), the alpha channel stays in place
+    or is dropped in the same pass.
+
+    Uses the vectorized opencv color conversion where possible, which is
+    much faster than fancy indexing with numpy.
+    """
+    if image.dtype in (np.uint8, np.uint16, np.float32):
+        if image.shape[2] == 3:
+            return cv2.cvtColor(image, cv2.COLOR_RGB2BGR)
+        if image.shape[2] == 4:
+            code = cv2.COLOR_RGBA2BGRA if keep_alpha else cv2.COLOR_RGBA2BGR
+            return cv2.cvtColor(image, code)
+    if image.shape[2] == 4 and keep_alpha:
+        return image[:, :, [2, 1, 0, 3]]
+    return image[:, :, 2::-1]
+
+
+_ENCODE_CACHE_SIZE = 32
+_ENCODE_CACHE_MAX_BYTES = 4 * 1024 * 1024
+_encode_cache: "OrderedDict[bytes, bytes | memoryview]" = OrderedDict()
+_encode_cache_lock = threading.Lock()
+
+
+def _encode_image(image: np.ndarray, encoding: str = "jpg", bgr: bool = False, quality: int = 95) -> bytes | memoryview:
+    """
+    Encode a numpy image into the bytes of an image file.
+
+    Results for small images are cached by their content, so images that
+    are added repeatedly (e.g. logos) are only encoded once. The cache is
+    shared by all documents, so it is locked for documents written from
+    multiple threads.
+    """
+    key = None
+    if image.nbytes < _ENCODE_CACHE_MAX_BYTES:
+        key = hashlib.blake2b(np.ascontiguousarray(image).data, digest_size=16).digest()
+        key += f"{image.shape}{image.dtype}{encoding}{bgr}{quality}".encode()
+        with _encode_cache_lock:
+            if key in _encode_cache:
+                _encode_cache.move_to_end(key)
+                return _encode_cache[key]
+    encoded_img = _encode_image_uncached(image, encoding, bgr, quality)
+    if key is not None:
+        with _encode_cache_lock:
+            _encode_cache[key] = encoded_img
+            if len(_encode_cache) > _ENCODE_CACHE_SIZE:
+                _encode_cache.popitem(last=False)
+    return encoded_img
+
+
+def _encode_image_uncached(image: np.ndarray, encoding: str, bgr: bool, quality: int) -> bytes | memoryview:
+    """
+    Jpegs are encoded with simplejpeg (libjpeg-turbo) if it is installed,
+    which reads the channel order directly. Otherwise opencv is used.
+    """
+    is_jpg = encoding in ("jpg", "jpeg")
+    if is_jpg and simplejpeg is not None and image.dtype == np.uint8:
+        if image.ndim == 2:
+            image = image[:, :, None]
+        colorspace = _SIMPLEJPEG_COLORSPACES.get((image.shape[2], bgr))
+        if colorspace is not None:
+            return simplejpeg.encode_jpeg(np.ascontiguousarray(image), quality=quality,
+                                          colorspace=colorspace, colorsubsampling="420",
+                                          fastdct=True)
+    if image.ndim == 3 and image.shape[2] == 1:
+        image = image[:, :, 0]
+    # Grayscale images are encoded directly, color images are converted
+    # once and, as jpegs have no alpha channel, alpha is dropped right away.
+    if image.ndim == 3 and not bgr:
+        image = _swap_red_blue(image, keep_alpha=not is_jpg)
+    params = []
+    if is_jpg:
+        params = [int(cv2.IMWRITE_JPEG_QUALITY), quality]
+    encoded_img = cv2.imencode(f".{encoding}", image, params)
+    # Expose the encoded buffer without copying it into a bytes object.
+    return memoryview(encoded_img[1].reshape(-1))
+
+
+class EmbeddedImage(object):
+    def __init__(self, encoded_img: bytes | memoryview, encoding: str, attributes: str = ""):
+        """
+        An image tag with a base64 data url, kept in the content buffers of
+        a document until it is written.
+
+        The base64 encoding is only done chunk by chunk while writing, so a
+        document never holds the (larger) base64 string of its images.
+
+        :param encoded_img: The bytes of the encoded image file.
+        :param encoding: The image encoding, e.g. "jpg" or "png".
+        :param attributes: (Default: "") Additional attributes of the tag.
+        """
+        self.encoded_img = encoded_img
+        self.encoding = encoding
+        self.attributes = attributes
+
+    def iter_chunks(self, chunk_size: int = 3 * 64 * 1024):
+        """
+        Yield the tag as text in chunks.
+
+        The chunk size must be a multiple of 3, so that no padding is
+        inserted between the base64 chunks.
+        """
+        yield f"<image {self.attributes} src='data:image/{self.encoding};base64,"
+        data = memoryview(self.encoded_img)
+        for start in range(0, len(data), chunk_size):
+            yield base64.b64encode(data[start:start + chunk_size]).decode('ascii')
+        yield "' />"
+
+    def __str__(self) -> str:
+        return "".join(self.iter_chunks())
+
+
+def _read_images(filenames: List[str], prefetch: int = 8):
+    """
+    Read images in order, while the following ones are read in background threads.
+
+    At most `prefetch` images are read ahead, which bounds the memory usage.
+    """
+    with ThreadPoolExecutor(max_workers=max(1, min(prefetch, len(filenames)))) as executor:
+        pending = deque()
+        for filename in filenames:
+            pending.append(executor.submit(imageio.imread, filename))
+            if len(pending) > prefetch:
+                yield pending.popleft().result()
+        while len(pending) > 0:
+            yield pending.popleft().result()
+
+
+def _encode_video(images: List[str], fps: float, path: str) -> None:
+    """
+    Encode the image files into a video at the given path.
+    """
+    with imageio.get_writer(path, mode='I', fps=fps) as writer:
+        for image in _read_images(images):
+            writer.append_data(image)
+
+
 class Document(object):
     def __init__(self,
                  document_path: str,
@@ -142,6 +311,7 @@ class Document(object):
         self._brand_color = brand_color
         self._autoflush = autoflush
         self._echo = echo
+        self._doc_stem = os.path.splitext(document_path)[0]
         self.appendix_id = 1
         if title != "":
             self.add_heading(title, level=1)
@@ -156,6 +326,28 @@ class Document(object):
         """
         raise NotImplementedError("Must be implemented by child class.")
 
+    def close(self) -> None:
+        """
+        Flush all remaining content and finalize the document.
+
+        Also called when the document is used as a context manager.
+        """
+        self.flush()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, exc_traceback) -> None:
+        self.close()
+
+    def _next_appendix_path(self, extension: str) -> str:
+        path = f"{self._doc_stem}.{self.appendix_id:04d}.{extension}"
+        self.appendix_id += 1
+        return path
+
+    def _relative_path(self, path: str) -> str:
+        return os.path.relpath(path, os.path.dirname(self._document_path) or ".")
+
     def _maybe_flush(self, flush: bool | None):
         if flush is None:
             flush = self._autoflush
@@ -192,11 +384,26 @@ class Document(object):
         """
         raise NotImplementedError("Must be implemented by child class.")
 
-    def add_image(self, image: np.ndarray, bgr=False, embed=True, encoding: str = "jpg", style: str = "", new_line=True, flush: bool | None = None) -> None:
+    def add_image(self, image: np.ndarray, bgr=False, embed=True, encoding: str = "jpg", style: str = "", new_line=True, flush: bool | None = None, quality: int = 95) -> None:
         """
         Add a numpy image to the document.
         """
-        pass
+        encoded_img = _encode_image(image, encoding, bgr, quality)
+        self.add_encoded_image(encoded_img, encoding, embed, style, new_line, flush)
+
+    def add_encoded_image(self, encoded_img: bytes | memoryview, encoding: str = "jpg", embed=True, style: str = "", new_line=True, flush: bool | None = None) -> None:
+        """
+        Add an encoded image (the bytes of an image file) to the document.
+        """
+        raise NotImplementedError("Must be implemented by child class.")
+
+    def add_image_by_path(self, path: str, style: str = "", new_line=True, flush: bool | None = None) -> None:
+        """
+        Add an existing image file to the document.
+
+        The image is referenced relative to the document and not copied.
+        """
+        raise NotImplementedError("Must be implemented by child class.")
 
     def add_plt(self, no_close=False, embed=True, style: str = "", new_line=True, flush: bool | None = None) -> None:
         """
@@ -209,17 +416,30 @@ class Document(object):
         plt.tight_layout()
         canvas.draw()
         width, height = canvas.get_width_height()
-        img_arr = np.frombuffer(canvas.buffer_rgba(), dtype=np.uint8)
-        img_arr = img_arr.reshape(int(height), int(width), -1)
+        img_arr = np.asarray(canvas.buffer_rgba())
+        img_arr = img_arr.reshape(int(height), int(width), 4)
+        # Converting creates the only copy needed, before the canvas buffer
+        # is released by closing the plot.
+        img_arr = cv2.cvtColor(img_arr, cv2.COLOR_RGBA2BGR)
         if not no_close:
             plt.close()
-        self.add_image(np.array(img_arr), embed=embed, style=style, new_line=new_line, flush=flush)
+        self.add_image(img_arr, bgr=True, embed=embed, style=style, new_line=new_line, flush=flush)
 
     def add_video(self, images: List[str], fps: float, style: str = "", new_line=True, autoplay: bool = True, flush: bool | None = None) -> None:
         """
         Add a numpy image to the document.
         """
-        pass
+        path = self._next_appendix_path("mp4")
+        _encode_video(images, fps, path)
+        self.add_video_by_path(path, style, new_line, autoplay, flush)
+
+    def add_video_by_path(self, path: str, style: str = "", new_line=True, autoplay: bool = True, flush: bool | None = None) -> None:
+        """
+        Add an existing video file to the document.
+
+        The video is referenced relative to the document and not copied.
+        """
+        raise NotImplementedError("Must be implemented by child class.")
 
     def add_table(self, header: list[Any], body: list[list[Any]], flush: bool | None = None) -> None:
         pass
@@ -1,21 +1,20 @@
-from typing import List, Any
-import base64
+from typing import Any
+import os
 import traceback
-import imageio
-import cv2
-import numpy as np
 
 
-from simple_md.document import Document, DEFAULT_STYLE
+from simple_md.document import Document, EmbeddedImage, DEFAULT_STYLE_MIN, minify_css
 
 
-HTML_TEMPLATE="""<html>
+HTML_HEADER = """<html>
 <head>
 <title>{title}</title>
 <style>{style}</style>
 </head>
 <body>
-<div class="content">{content}
+<div class="content">"""
+
+HTML_FOOTER = """
 
 </div>
 </body>
@@ -50,8 +49,9 @@ class HTMLDocument(Document):
         if not document_path.endswith(".html"):
             raise RuntimeError("The document path must end on '.html' " + 
                                "since it is an html document.")
-        self._css = css
-        self._content = ""
+        self._style = DEFAULT_STYLE_MIN.replace("{brand_color}", brand_color) + minify_css(css).lstrip()
+        self._content: list[str | EmbeddedImage] = []
+        self._header_written = False
         super().__init__(document_path, title, author, brand_color, autoflush, echo)
 
     def flush(self) -> None:
@@ -60,44 +60,78 @@ class HTMLDocument(Document):
          
         Automatically done after each add, unless you specify differently.
         """
-        with open(self._document_path, "w") as f:
-            style = DEFAULT_STYLE.replace("{brand_color}", self._brand_color)
-            style = f"{style}\n{self._css}"
-            style = style.replace("\n", " ")
-            while "  " in style:
-                style = style.replace("  ", " ")
-            f.write(HTML_TEMPLATE.format(
-                title=self._title,
-                style=style,
-                content=self._content
-            ))
+        if self._header_written and len(self._content) == 0:
+            return
+        if self._header_written and not os.path.exists(self._document_path):
+            # The flushed content is only on disk, a new file would
+            # silently lose it.
+            raise RuntimeError(f"Cannot append to '{self._document_path}', " +
+                               "the file was removed after it was written.")
+        if not self._header_written:
+            header = HTML_HEADER.format(title=self._title, style=self._style)
+            with open(self._document_path, "wb") as f:
+                f.write(header.encode("utf-8"))
+                self._write_content(f)
+            self._header_written = True
+        else:
+            # Only append the new content by overwriting the footer,
+            # so the file stays a complete html document after each flush.
+            footer = HTML_FOOTER.encode("utf-8")
+            with open(self._document_path, "rb+") as f:
+                size = f.seek(0, os.SEEK_END)
+                if size >= len(footer):
+                    f.seek(size - len(footer))
+                if size < len(footer) or f.read() != footer:
+                    raise RuntimeError(f"Cannot append to '{self._document_path}', " +
+                                       "it does not end with the html footer anymore.")
+                f.seek(size - len(footer))
+                try:
+                    self._write_content(f)
+                except BaseException:
+                    # Restore the footer, so the document stays complete
+                    # and the content is written again by the next flush.
+                    f.seek(size - len(footer))
+                    f.truncate()
+                    f.write(footer)
+                    raise
+        self._content.clear()
+
+    def _write_content(self, f) -> None:
+        for entry in self._content:
+            f.write(b"\n")
+            if isinstance(entry, str):
+                f.write(entry.encode("utf-8"))
+            else:
+                for chunk in entry.iter_chunks():
+                    f.write(chunk.encode("utf-8"))
+        f.write(HTML_FOOTER.encode("utf-8"))
 
     def add_heading(self, text: str, level: int = 2, flush: bool | None = None) -> None:
         """
         Add a heading to the document.
         """
-        self._content = f"{self._content}\n\n<h{level}>{text}</h{level}>"
+        self._content.append(f"\n<h{level}>{text}</h{level}>")
         self._maybe_flush(flush)
 
     def add_infobox(self, text: str, flush: bool | None = None) -> None:
         """
         Add an infobox to the document.
         """
-        self._content = f"{self._content}\n<blockquote>{text}</blockquote>"
+        self._content.append(f"<blockquote>{text}</blockquote>")
         self._maybe_flush(flush)
 
     def add_paragraph(self, text: str, flush: bool | None = None) -> None:
         """
         Add a paragraph to the document.
         """
-        self._content = f"{self._content}\n<p>{text}</p>"
+        self._content.append(f"<p>{text}</p>")
         self._maybe_flush(flush)
 
     def add_code(self, text: str, flush: bool | None = None) -> None:
         """
         Add a preformated code section to the document.
         """
-        self._content = f"{self._content}\n<pre>{text}</pre>"
+        self._content.append(f"<pre>{text}</pre>")
         self._maybe_flush(flush)
 
     def add_exception(self, flush: bool | None = None) -> None:
@@ -105,65 +139,61 @@ class HTMLDocument(Document):
         Add an exception to the document.
         """
         text = traceback.format_exc()
-        self._content = f"{self._content}\n<pre>{text}</pre>"
+        self._content.append(f"<pre>{text}</pre>")
         self._maybe_flush(flush)
 
-    def add_image(self, image: np.ndarray, bgr=False, embed=True, encoding: str = "jpg", style: str = "", new_line=True, flush: bool | None = None) -> None:
+    def add_encoded_image(self, encoded_img: bytes | memoryview, encoding: str = "jpg", embed=True, style: str = "", new_line=True, flush: bool | None = None) -> None:
         """
-        Add a numpy image to the html document.
+        Add an encoded image (the bytes of an image file) to the html document.
         """
-        if not bgr and len(image.shape) == 3:
-            # only do first 3 channels, as alpha needs to stay
-            image = image.copy()
-            image[:,:,0:3] = image[:,:,0:3][:,:,::-1]
+        if not embed:
+            path = self._next_appendix_path(encoding)
+            with open(path, "wb") as f:
+                f.write(encoded_img)
+            self.add_image_by_path(path, style, new_line, flush)
+            return
         if style != "":
             style = f" style='{style}'"
-        if embed:
-            encoded_img = cv2.imencode(f".{encoding}", image)
-            b64_string = base64.b64encode(encoded_img[1]).decode('utf-8')
-            self._content = f"{self._content}\n<image {style} src='data:image/{encoding};base64,{b64_string}' />"
-        else:
-            path = self._document_path.replace(".html", f".{self.appendix_id:04d}.{encoding}")
-            self.appendix_id += 1
-            cv2.imwrite(path, image)
-            relative_path = path.split('/')[-1]
-            self._content = f"{self._content}\n<image {style} src='{relative_path}' />"
+        self._content.append(EmbeddedImage(encoded_img, encoding, style))
+        if new_line:
+            self._content.append("<BR>")
+        self._maybe_flush(flush)
+
+    def add_image_by_path(self, path: str, style: str = "", new_line=True, flush: bool | None = None) -> None:
+        """
+        Add an existing image file to the html document.
+        """
+        if style != "":
+            style = f" style='{style}'"
+        relative_path = self._relative_path(path)
+        self._content.append(f"<image {style} src='{relative_path}' />")
         if new_line:
-            self._content = f"{self._content}\n<BR>"
+            self._content.append("<BR>")
         self._maybe_flush(flush)
 
-    def add_video(self, images: List[str], fps: float, style: str = "", new_line=True, autoplay: bool = True, flush: bool | None = None) -> None:
+    def add_video_by_path(self, path: str, style: str = "", new_line=True, autoplay: bool = True, flush: bool | None = None) -> None:
         """
-        Add a numpy image to the html document.
+        Add an existing video file to the html document.
         """
-        path = self._document_path.replace(".html", f".{self.appendix_id:04d}.mp4")
-        self.appendix_id += 1
-        with imageio.get_writer(path, mode='I', fps=fps) as writer:
-            for filename in images:
-                image = imageio.imread(filename)
-                writer.append_data(image)
         if style != "":
             style = f" style='{style}'"
-        relative_path = path.split('/')[-1]
+        relative_path = self._relative_path(path)
         autoplay_str = "autoplay " if autoplay else ""
-        self._content = f"{self._content}\n<video {style} src='{relative_path}' controls {autoplay_str}loop muted></video>"
+        self._content.append(f"<video {style} src='{relative_path}' controls {autoplay_str}loop muted></video>")
         if new_line:
-            self._content = f"{self._content}\n<BR>"
+            self._content.append("<BR>")
         self._maybe_flush(flush)
 
     def add_table(self, header: list[Any], body: list[list[Any]], flush: bool | None = None):
-        content = ""
         header_html = "".join([f"<th>{x}</th>" for x in header])
-        content += f"<thead>\n<tr>{header_html}</tr>\n</thead>\n"
-        content += "<tbody>\n"
-        for line in body:
-            row = "".join([f"<td>{x}</td>" for x in line])
-            content += f"<tr>{row}</tr>\n"
-        content += "</tbody>\n"
-        table = f"<table>\n{content}</table>"
-        self._content = f"{self._content}\n{table}"
+        rows_html = "".join([
+            "<tr>" + "".join([f"<td>{x}</td>" for x in line]) + "</tr>\n"
+            for line in body
+        ])
+        table = f"<table>\n<thead>\n<tr>{header_html}</tr>\n</thead>\n<tbody>\n{rows_html}</tbody>\n</table>"
+        self._content.append(table)
         self._maybe_flush(flush)
 
     def add_separator(self, flush: bool | None = None):
-        self._content = f"{self._content}\n<HR>"
+        self._content.append("<HR>")
         self._maybe_flush(flush)
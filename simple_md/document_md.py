@@ -1,12 +1,30 @@
-from typing import List, Any
-import base64
+from typing import Any
+import re
 import traceback
-import imageio
-import cv2
-import numpy as np
 
 
-from simple_md.document import Document, DEFAULT_STYLE
+from simple_md.document import Document, EmbeddedImage, DEFAULT_STYLE_MIN, minify_css
+
+
+_MULTI_NEWLINE = re.compile(r"\n{2,}")
+
+
+class CodeBlock(object):
+    def __init__(self, text: str):
+        """
+        A fenced code block in the linebuffer of a markdown document.
+
+        The text is written as a whole instead of being split into lines.
+        """
+        self.text = text
+
+    def iter_chunks(self):
+        yield "```\n"
+        yield self.text
+        yield "\n```"
+
+    def __str__(self) -> str:
+        return "".join(self.iter_chunks())
 
 
 class MDDocument(Document):
@@ -40,27 +58,42 @@ class MDDocument(Document):
         if not document_path.endswith(".md"):
             raise RuntimeError("The document path must end on '.md' " +
                                "since it is a markdown document.")
-        with open(document_path, "w") as f:
-            if include_style:
-                md_style = DEFAULT_STYLE.replace("{brand_color}", brand_color)
-                md_style = md_style.replace(".content", "body") + css
-                md_style = md_style.replace("\n", " ")
-                while "  " in md_style:
-                    md_style = md_style.replace("  ", " ")
-                f.write(f"<style>{md_style}</style>\n\n")
-            else:
-                f.write("")
+        # Keep the file open, so flushing only appends to a buffered writer.
+        self._file = open(document_path, "w", buffering=1 << 16)
+        if include_style:
+            md_style = DEFAULT_STYLE_MIN.replace("{brand_color}", brand_color)
+            md_style = md_style.replace(".content", "body") + minify_css(css).lstrip()
+            self._file.write(f"<style>{md_style}</style>\n\n")
         super().__init__(document_path, title, author, brand_color, autoflush, echo)
 
     def flush(self):
         if len(self.linebuffer) > 0:
-            with open(self._document_path, "a") as f:
-                while len(self.linebuffer) > 0:
-                    line = self.linebuffer.pop(0)
-                    f.write(f"{line}\n")
-                    if self._echo:
-                        print(line)
-    
+            self._file.writelines(self._iter_linebuffer())
+            self._file.flush()
+            if self._echo:
+                for line in self.linebuffer:
+                    print(line)
+            self.linebuffer.clear()
+
+    def _iter_linebuffer(self):
+        for line in self.linebuffer:
+            if isinstance(line, str):
+                yield line
+            else:
+                yield from line.iter_chunks()
+            yield "\n"
+
+    def close(self) -> None:
+        """
+        Flush all remaining content and close the file.
+        """
+        self.flush()
+        self._file.close()
+
+    def __del__(self):
+        if hasattr(self, "_file"):
+            self._file.close()
+
     def add_heading(self, text: str, level: int = 2, flush: bool | None = None):
         indentation = "#" * level
         self.linebuffer.extend([
@@ -79,8 +112,7 @@ class MDDocument(Document):
         self._maybe_flush(flush)
 
     def add_paragraph(self, text: str, flush: bool | None = None):
-        while "\n\n" in text:
-            text = text.replace("\n\n", "\n")
+        text = _MULTI_NEWLINE.sub("\n", text)
         self.linebuffer.extend(
             text.split("\n") + [""])
         self._maybe_flush(flush)
@@ -89,9 +121,7 @@ class MDDocument(Document):
         """
         Add a preformated code section to the document.
         """
-        self.linebuffer.extend(
-            ["```"] + text.split("\n") + ["```", ""]
-        )
+        self.linebuffer.extend([CodeBlock(text), ""])
         self._maybe_flush(flush)
 
     def add_exception(self, flush: bool | None = None) -> None:
@@ -99,51 +129,46 @@ class MDDocument(Document):
         Add an exception to the document.
         """
         text = traceback.format_exc()
-        self.linebuffer.extend(
-            ["```"] + text.split("\n") + ["```", ""]
-        )
+        self.linebuffer.extend([CodeBlock(text), ""])
         self._maybe_flush(flush)
 
-    def add_image(self, image: np.ndarray, bgr=False, embed=True, encoding: str = "jpg", style: str = "", new_line=True, flush: bool | None = None) -> None:
+    def add_encoded_image(self, encoded_img: bytes | memoryview, encoding: str = "jpg", embed=True, style: str = "", new_line=True, flush: bool | None = None) -> None:
         """
-        Add a numpy image to the document.
+        Add an encoded image (the bytes of an image file) to the document.
         """
-        if not bgr and len(image.shape) == 3:
-            # only do first 3 channels, as alpha needs to stay
-            image = image.copy()
-            image[:,:,0:3] = image[:,:,0:3][:,:,::-1]
+        if not embed:
+            path = self._next_appendix_path(encoding)
+            with open(path, "wb") as f:
+                f.write(encoded_img)
+            self.add_image_by_path(path, style, new_line, flush)
+            return
         if style != "":
             style = f" style='{style}'"
         add_line = [""] if new_line else []
-        if embed:
-            encoded_img = cv2.imencode(f".{encoding}", image)
-            b64_string = base64.b64encode(encoded_img[1]).decode('utf-8')
-            self.linebuffer.extend([
-                f"<image class='image' {style} src='data:image/{encoding};base64,{b64_string}' />",
-            ] + add_line)
-        else:
-            path = self._document_path.replace(".md", f".{self.appendix_id:04d}.{encoding}")
-            self.appendix_id += 1
-            cv2.imwrite(path, image)
-            relative_path = path.split('/')[-1]
-            self.linebuffer.extend([f"<image {style} src='{relative_path}' />"] + add_line)
+        self.linebuffer.extend([
+            EmbeddedImage(encoded_img, encoding, f"class='image' {style}"),
+        ] + add_line)
         self._maybe_flush(flush)
 
+    def add_image_by_path(self, path: str, style: str = "", new_line=True, flush: bool | None = None) -> None:
+        """
+        Add an existing image file to the document.
+        """
+        if style != "":
+            style = f" style='{style}'"
+        add_line = [""] if new_line else []
+        relative_path = self._relative_path(path)
+        self.linebuffer.extend([f"<image {style} src='{relative_path}' />"] + add_line)
+        self._maybe_flush(flush)
 
-    def add_video(self, images: List[str], fps: float, style: str = "", new_line=True, autoplay: bool = True, flush: bool | None = None) -> None:
+    def add_video_by_path(self, path: str, style: str = "", new_line=True, autoplay: bool = True, flush: bool | None = None) -> None:
         """
-        Add a numpy image to the document.
+        Add an existing video file to the document.
         """
-        path = self._document_path.replace(".md", f".{self.appendix_id:04d}.mp4")
-        self.appendix_id += 1
-        with imageio.get_writer(path, mode='I', fps=fps) as writer:
-            for filename in images:
-                image = imageio.imread(filename)
-                writer.append_data(image)
         if style != "":
             style = f" style='{style}'"
         add_line = [""] if new_line else []
-        relative_path = path.split('/')[-1]
+        relative_path = self._relative_path(path)
         autoplay_str = "autoplay " if autoplay else ""
         self.linebuffer.extend([
                 f"<video class='image' {style} src='{relative_path}' controls {autoplay_str}loop muted></video>",
@@ -155,8 +180,10 @@ class MDDocument(Document):
             "| " + " | ".join([str(x).replace("|", "/") for x in header]) + " |",
             "| " + " | ".join(["---" for _ in header]) + " |"
         ]
-        for line in body:
-            table.append("| " + " | ".join([str(x).replace("|", "/") for x in line]) + " |")
+        table.extend([
+            "| " + " | ".join([str(x).replace("|", "/") for x in line]) + " |"
+            for line in body
+        ])
         self.linebuffer.extend(
             table + [""])
         self._maybe_flush(flush)
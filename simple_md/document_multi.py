@@ -1,8 +1,9 @@
 from typing import List, Any
+import cv2
 import numpy as np
 import matplotlib.pyplot as plt
 
-from simple_md.document import Document
+from simple_md.document import Document, _encode_video
 from simple_md.document_html import HTMLDocument
 from simple_md.document_md import MDDocument
 
@@ -52,6 +53,25 @@ class MultiDocument(Document):
         self.md.flush()
         self.html.flush()
 
+    def close(self) -> None:
+        """
+        Flush all remaining content and finalize both documents.
+        """
+        self.md.close()
+        self.html.close()
+
+    def _next_appendix_path(self, extension: str) -> str:
+        """
+        Take the next appendix id from both documents, since they share
+        the file. The ids only ever advance, so the file cannot collide
+        with an appendix of either document.
+        """
+        self.appendix_id = max(self.md.appendix_id, self.html.appendix_id)
+        path = super()._next_appendix_path(extension)
+        self.md.appendix_id = self.appendix_id
+        self.html.appendix_id = self.appendix_id
+        return path
+
     def add_heading(self, text: str, level: int = 2, flush: bool | None = None) -> None:
         """
         Add a heading to the document.
@@ -87,12 +107,29 @@ class MultiDocument(Document):
         self.md.add_exception(flush)
         self.html.add_exception(flush)
 
-    def add_image(self, image: np.ndarray, bgr=False, embed=True, encoding: str = "jpg", style: str = "", new_line=True, flush: bool | None = None) -> None:
+    def add_encoded_image(self, encoded_img: bytes | memoryview, encoding: str = "jpg", embed=True, style: str = "", new_line=True, flush: bool | None = None) -> None:
         """
-        Add a numpy image to the document.
+        Add an encoded image (the bytes of an image file) to the document.
+
+        Used by `add_image`, so an image is converted and encoded only once
+        and then shared by both documents.
+        """
+        if not embed:
+            # Write the file once and reference it from both documents.
+            path = self._next_appendix_path(encoding)
+            with open(path, "wb") as f:
+                f.write(encoded_img)
+            self.add_image_by_path(path, style, new_line, flush)
+            return
+        self.md.add_encoded_image(encoded_img, encoding, embed, style, new_line, flush)
+        self.html.add_encoded_image(encoded_img, encoding, embed, style, new_line, flush)
+
+    def add_image_by_path(self, path: str, style: str = "", new_line=True, flush: bool | None = None) -> None:
+        """
+        Add an existing image file to the document.
         """
-        self.md.add_image(image, bgr, embed, encoding, style, new_line, flush)
-        self.html.add_image(image, bgr, embed, encoding, style, new_line, flush)
+        self.md.add_image_by_path(path, style, new_line, flush)
+        self.html.add_image_by_path(path, style, new_line, flush)
 
     def add_plt(self, no_close=False, embed=True, style: str = "", new_line=True, flush: bool | None = None) -> None:
         """
@@ -105,19 +142,31 @@ class MultiDocument(Document):
         plt.tight_layout()
         canvas.draw()
         width, height = canvas.get_width_height()
-        img_arr = np.frombuffer(canvas.buffer_rgba(), dtype=np.uint8)
-        img_arr = img_arr.reshape(int(height), int(width), -1)
+        img_arr = np.asarray(canvas.buffer_rgba())
+        img_arr = img_arr.reshape(int(height), int(width), 4)
+        # Converting creates the only copy needed, before the canvas buffer
+        # is released by closing the plot.
+        img_arr = cv2.cvtColor(img_arr, cv2.COLOR_RGBA2BGR)
         if not no_close:
             plt.close()
-        self.add_image(np.array(img_arr), embed=embed, style=style, new_line=new_line, flush=flush)
+        self.add_image(img_arr, bgr=True, embed=embed, style=style, new_line=new_line, flush=flush)
 
     def add_video(self, images: List[str], fps: float, style: str = "", new_line=True, autoplay: bool = True, flush: bool | None = None) -> None:
         """
         Add a numpy image to the document.
         """
         assert len(images) > 2
-        self.md.add_video(images[:2], fps, style, new_line, autoplay, flush)
-        self.html.add_video(images, fps, style, new_line, autoplay, flush)
+        # Encode the video once and reference it from both documents.
+        path = self._next_appendix_path("mp4")
+        _encode_video(images, fps, path)
+        self.add_video_by_path(path, style, new_line, autoplay, flush)
+
+    def add_video_by_path(self, path: str, style: str = "", new_line=True, autoplay: bool = True, flush: bool | None = None) -> None:
+        """
+        Add an existing video file to the document.
+        """
+        self.md.add_video_by_path(path, style, new_line, autoplay, flush)
+        self.html.add_video_by_path(path, style, new_line, autoplay, flush)
 
     def add_table(self, header: list[Any], body: list[list[Any]], flush: bool | None = None) -> None:
         self.md.add_table(header, body, flush)
@@ -1,84 +1,233 @@
+from concurrent.futures import ThreadPoolExecutor
 import cv2
 import base64
+import errno
+import functools
 import os
+import re
+import shutil
+
+try:
+    import simplejpeg
+except ImportError:
+    simplejpeg = None
+
+
+# Matches markdown images `![alt](url)` and html `<img>`/`<image>` tags,
+# which do not already embed their image as a data url.
+_TAG_RE = re.compile(
+    rb"!\[(?P<alt>[^\]]*)\]\((?P<mdurl>(?!data:)[^)]+)\)"
+    rb"|<(?:img|image)\s[^>]*?src=(?P<q>['\"])(?P<url>(?!data:)[^'\"]+)(?P=q)[^>]*>"
+)
+
+# Only the `width` property, not `min-width` or `max-width`.
+_WIDTH_RE = re.compile(rb"(?<![\w-])width\s*:\s*(\d+(?:\.\d+)?)%")
+
+_IMREAD_FLAGS = {
+    1: cv2.IMREAD_COLOR,
+    2: cv2.IMREAD_REDUCED_COLOR_2,
+    4: cv2.IMREAD_REDUCED_COLOR_4,
+}
+
+_FILE_EXTENSIONS = {
+    "jpg": (".jpg", ".jpeg"),
+    "jpeg": (".jpg", ".jpeg"),
+    "png": (".png",),
+}
+
+# Errors of os.link on filesystems or devices without hardlink support,
+# where the backup falls back to copying the image.
+_LINK_UNSUPPORTED = {errno.EXDEV, errno.EPERM, errno.ENOTSUP, errno.EOPNOTSUPP, errno.EMLINK}
 
 
 def main():
     import sys
     path = sys.argv[1]
+    backup = "--backup" in sys.argv[2:]
     if os.path.isdir(path):
-        for fname in os.listdir(path):
-            if fname.endswith(".md"):
-                embed_images(os.path.join(path, fname))
+        with os.scandir(path) as entries:
+            fnames = [
+                entry.path for entry in entries
+                if entry.name.endswith(".md") and entry.is_file()
+            ]
+        if len(fnames) == 1:
+            embed_images(fnames[0], backup=backup)
+            return
+        # Files are independent and the work is mostly io and opencv,
+        # which both release the GIL. The images of each file are then
+        # encoded serially, so at most one thread per core is used.
+        embed_serially = functools.partial(embed_images, parallel=False, backup=backup)
+        with ThreadPoolExecutor(max_workers=os.cpu_count()) as executor:
+            for _ in executor.map(embed_serially, fnames):
+                pass
     else:
-        embed_images(path)
+        embed_images(path, backup=backup)
 
 
-def embed_images(fname: str) -> None:
-    folder = os.path.dirname(fname)
-    has_changes = False
-    with open(fname, "r") as f:
-        data = f.read().split("\n")
-    images = []
-    for idx in range(len(data)):
-        line = data[idx]
-        content = ""
-        if "<image " in line:
-            content = _find_tag_content(line, "<image ", ">")
-        if "<img " in line:
-            content = _find_tag_content(line, "<img ", ">")
-        if "![" in line:
-            content = _find_tag_content(line, "![", ")")
-            url = _find_tag_content(content + ")", "](", ")")
-            line = line.replace(f"![{content})", f"<img src='{url}' />")
-            data[idx] = line
-            content = f"src='{url}'"
-        if "src" in content and "src='data" not in content and "src=\"data" not in content:
-            url_start = content.index("src=") + len("src=")
-            url_end = content.index(content[url_start], url_start + 1)
-            url = content[url_start + 1:url_end]
-            image_path = os.path.join(folder, url)
-            images.append(image_path)
-            encoded = _encode_image(image_path)
-            data[idx] = line.replace(url, encoded)
-            has_changes = True
-    if has_changes:
-        #backup(fname, images)
-        _remove_files(images)
-        with open(fname, "w") as f:
-            f.write("\n".join(data))
-
-
-def _find_tag_content(line: str, start_str: str, end_str: str) -> str:
-    start = line.index(start_str)
-    end = line.index(end_str, start)
-    if start < 0:
-        print("ERROR: Cannot find start of image tag. Skipping...")
-        return ""
-    if end < 0:
-        print("ERROR: Cannot find end of image tag. Skipping...")
-        return ""
-    return line[start+len(start_str):end]
-
-
-def _encode_image(fname: str, encoding: str = "jpg") -> str:
-    image = cv2.imread(fname)
-    encoded_img = cv2.imencode(f".{encoding}", image)
-    b64_string = base64.b64encode(encoded_img[1]).decode('utf-8')
-    return f"data:image/{encoding};base64,{b64_string}"
-
-
-def _backup(fname, images):
+def embed_images(fname: str, quality: int = 85, downscale: bool = False, parallel: bool = True,
+                 backup: bool = False) -> None:
+    """
+    Embed all images referenced by a markdown file as base64 data urls
+    and remove the image files.
+
+    :param fname: The markdown file.
+    :param quality: (Default: 85) The jpeg quality for images that need
+        to be encoded.
+    :param downscale: (Default: False) Decode images at half or quarter
+        resolution, when their tag style displays them at most 50% or
+        25% wide.
+    :param parallel: (Default: True) Encode the images in parallel threads,
+        disable it when multiple files are already processed in parallel.
+    :param backup: (Default: False) Keep the original file and its images
+        in a "backup" folder next to the file. Each run uses a new numbered
+        folder inside of it, e.g. "backup/0001", so backups are never
+        overwritten. Images outside of the folder of the file are kept
+        in "external" by their absolute path.
+    """
     folder = os.path.dirname(fname)
-    backup_folder = os.path.join(folder, "backup")
-    if not os.path.exists(backup_folder):
-        os.makedirs(backup_folder)
-    with open(fname, "r") as f:
-        original = f.read().split("\n")
-    with open(fname.replace(folder, backup_folder), "w") as f:
-        f.write("\n".join(original))
+    # The file is processed as bytes, so the base64 data urls never need
+    # to be decoded into text.
+    with open(fname, "rb") as f:
+        text = f.read()
+    # Substring search is much faster than the regex for files without images.
+    if b"![" not in text and b"<im" not in text:
+        return
+    matches = list(_TAG_RE.finditer(text))
+    if len(matches) == 0:
+        return
+    image_keys = [
+        (
+            os.path.abspath(os.path.join(folder, (match.group("mdurl") or match.group("url")).decode("utf-8"))),
+            _display_scale(match.group(0)) if downscale else 1,
+        )
+        for match in matches
+    ]
+    # Encode every image only once, even if it is used multiple times.
+    # opencv releases the GIL while reading and encoding, so threads run
+    # in parallel.
+    unique_keys = list(dict.fromkeys(image_keys))
+
+    def encode(key):
+        return _encode_image(key[0], quality=quality, scale=key[1])
+
+    if parallel and len(unique_keys) > 1:
+        with ThreadPoolExecutor(max_workers=min(os.cpu_count() or 1, len(unique_keys))) as executor:
+            encoded_images = dict(zip(unique_keys, executor.map(encode, unique_keys)))
+    else:
+        encoded_images = dict(zip(unique_keys, map(encode, unique_keys)))
+    images = list(dict.fromkeys(image_path for image_path, _ in unique_keys))
+    # Slices of the memoryview reference the unchanged text without copying it,
+    # the file content stays in memory while the file is rewritten.
+    text_view = memoryview(text)
+    parts = []
+    last_end = 0
+    for match, image_key in zip(matches, image_keys):
+        if match.group("mdurl") is not None:
+            # Markdown images are replaced by an html tag.
+            start, end = match.span()
+            prefix, suffix = b"<img src='", b"' />"
+        else:
+            start, end = match.span("url")
+            prefix, suffix = b"", b""
+        parts.extend([text_view[last_end:start], prefix, encoded_images[image_key], suffix])
+        last_end = end
+    parts.append(text_view[last_end:])
+    if backup:
+        _backup(fname, images, text)
+    # Remove the image files in the background, while writing the document.
+    with ThreadPoolExecutor(max_workers=1) as executor:
+        removed = executor.submit(_remove_files, images)
+        # Write the parts directly instead of joining them into one big
+        # bytes object first.
+        with open(fname, "wb", buffering=1 << 20) as f:
+            f.writelines(parts)
+        removed.result()
+
+
+def _display_scale(tag: bytes) -> int:
+    """
+    Get by how much an image can be reduced, given the width in percent
+    of the page that its tag style displays it at.
+    """
+    match = _WIDTH_RE.search(tag)
+    if match is None:
+        return 1
+    width = float(match.group(1))
+    if width <= 25:
+        return 4
+    if width <= 50:
+        return 2
+    return 1
+
+
+def _encode_image(fname: str, encoding: str = "jpg", quality: int = 85, scale: int = 1) -> bytes:
+    prefix = b"data:image/" + encoding.encode() + b";base64,"
+    if scale == 1 and fname.lower().endswith(_FILE_EXTENSIONS.get(encoding, ())):
+        # The file already has the target format, so its bytes are embedded
+        # as they are, without decoding and encoding it again.
+        with open(fname, "rb") as f:
+            return prefix + base64.b64encode(f.read())
+    # Reduced reading decodes jpegs directly at a lower resolution.
+    image = cv2.imread(fname, _IMREAD_FLAGS[scale])
+    if encoding in ("jpg", "jpeg") and simplejpeg is not None:
+        # libjpeg-turbo is faster than opencv and reads the BGR image directly.
+        encoded_img = simplejpeg.encode_jpeg(image, quality=quality, colorspace="BGR",
+                                             colorsubsampling="420", fastdct=True)
+        return prefix + base64.b64encode(encoded_img)
+    encoded_img = cv2.imencode(f".{encoding}", image, _imencode_params(encoding, quality))
+    return prefix + base64.b64encode(encoded_img[1])
+
+
+@functools.lru_cache(maxsize=None)
+def _imencode_params(encoding: str, quality: int) -> tuple:
+    if encoding in ("jpg", "jpeg"):
+        return (int(cv2.IMWRITE_JPEG_QUALITY), quality, int(cv2.IMWRITE_JPEG_OPTIMIZE), 1)
+    return ()
+
+
+def _backup(fname, images, original_text: bytes):
+    folder = os.path.dirname(os.path.abspath(fname))
+    # Images keep their path relative to the document, so images with the
+    # same name in different folders do not collide. Images outside of the
+    # document folder are kept by their absolute path in "external".
+    relative_paths = []
     for image in images:
-        os.rename(image, image.replace(folder, backup_folder))
+        relative_path = os.path.relpath(image, folder)
+        if relative_path == os.pardir or relative_path.startswith(os.pardir + os.sep):
+            drive, image_path = os.path.splitdrive(image)
+            relative_path = os.path.join("external", drive.replace(":", ""), image_path.lstrip("\\/"))
+        relative_paths.append(relative_path)
+    backup_folder = _new_backup_folder(os.path.join(folder, "backup"))
+    with open(os.path.join(backup_folder, os.path.basename(fname)), "xb") as f:
+        f.write(original_text)
+    # Hardlinks keep the data without copying it, the originals are
+    # removed afterwards by _remove_files.
+    for image, relative_path in zip(images, relative_paths):
+        backup_image = os.path.join(backup_folder, relative_path)
+        os.makedirs(os.path.dirname(backup_image), exist_ok=True)
+        try:
+            os.link(image, backup_image)
+        except OSError as e:
+            if e.errno not in _LINK_UNSUPPORTED:
+                raise
+            with open(image, "rb") as src, open(backup_image, "xb") as dst:
+                shutil.copyfileobj(src, dst)
+            shutil.copystat(image, backup_image)
+
+
+def _new_backup_folder(path: str) -> str:
+    """
+    Create the next free numbered folder, e.g. "backup/0001". Creating it
+    fails if it exists, so parallel runs never share a folder.
+    """
+    backup_id = 1
+    while True:
+        backup_folder = os.path.join(path, f"{backup_id:04d}")
+        try:
+            os.makedirs(backup_folder)
+            return backup_folder
+        except FileExistsError:
+            backup_id += 1
 
 
 def _remove_files(files):
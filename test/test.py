@@ -67,6 +67,7 @@ def _test_common(document: Document, base_path: str):
     folder = f"{base_path}/data/video"
     paths = [os.path.join(folder, x) for x in os.listdir(folder) if x.endswith(".png") or x.endswith(".jpg")]
     document.add_video(sorted(paths), fps=30, style="width:49%")
+    document.close()
 
 
 def test_html(base_path):
@@ -0,0 +1,39 @@
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+import time
+import numpy as np
+
+import simple_md.document as document
+
+
+class _SlowCache(OrderedDict):
+    def __contains__(self, key):
+        found = super().__contains__(key)
+        # Give other threads the chance to evict the key in between.
+        time.sleep(0.0001)
+        return found
+
+
+def test_encode_image_threads():
+    # More distinct images than the cache holds, so entries are evicted
+    # while other threads look them up.
+    images = [np.full((2, 2, 3), idx, dtype=np.uint8) for idx in range(40)]
+    expected = [bytes(document._encode_image_uncached(image, "jpg", False, 95)) for image in images]
+
+    def encode(idx):
+        return bytes(document._encode_image(images[idx]))
+
+    encode_cache = document._encode_cache
+    document._encode_cache = _SlowCache()
+    try:
+        with ThreadPoolExecutor(max_workers=8) as executor:
+            # Random repeats hit the cache, unlike a cycle through all images.
+            indices = np.random.default_rng(0).integers(0, len(images), 2000).tolist()
+            for idx, encoded in zip(indices, executor.map(encode, indices)):
+                assert encoded == expected[idx]
+    finally:
+        document._encode_cache = encode_cache
+
+
+if __name__ == "__main__":
+    test_encode_image_threads()
@@ -0,0 +1,89 @@
+import os
+import tempfile
+
+from simple_md import HTMLDocument
+from simple_md.document_html import HTML_FOOTER
+
+
+class _FailingEntry(object):
+    def iter_chunks(self):
+        yield "<p>partial</p>"
+        raise IOError("Disk full.")
+
+
+def _read(fname: str) -> str:
+    with open(fname, "r") as f:
+        return f.read()
+
+
+def test_flush():
+    with tempfile.TemporaryDirectory() as folder:
+        fname = os.path.join(folder, "test.html")
+        document = HTMLDocument(fname, title="Title", autoflush=True)
+        text = _read(fname)
+        assert text.startswith("<html>")
+        assert text.endswith("\n<h1>Title</h1>" + HTML_FOOTER)
+
+        # The footer is replaced by the new content and written again.
+        document.add_paragraph("x")
+        document.add_paragraph("y")
+        text = _read(fname)
+        assert text.endswith("\n<h1>Title</h1>\n<p>x</p>\n<p>y</p>" + HTML_FOOTER)
+        assert text.count(HTML_FOOTER) == 1
+
+
+def test_flush_footer_mismatch():
+    with tempfile.TemporaryDirectory() as folder:
+        fname = os.path.join(folder, "test.html")
+        document = HTMLDocument(fname, title="Title", autoflush=True)
+        with open(fname, "a") as f:
+            f.write("<!-- edited -->")
+        text = _read(fname)
+
+        try:
+            document.add_paragraph("x")
+            assert False, "Appending to a modified file must fail."
+        except RuntimeError:
+            pass
+        assert _read(fname) == text
+
+
+def test_flush_failed_write():
+    with tempfile.TemporaryDirectory() as folder:
+        fname = os.path.join(folder, "test.html")
+        document = HTMLDocument(fname, title="Title", autoflush=True)
+        document.add_paragraph("x", flush=False)
+        document._content.append(_FailingEntry())
+
+        try:
+            document.flush()
+            assert False, "The failing entry must raise."
+        except IOError:
+            pass
+        # The footer is restored and the content is kept for the next flush.
+        assert _read(fname).endswith("\n<h1>Title</h1>" + HTML_FOOTER)
+        document._content.pop()
+        document.flush()
+        assert _read(fname).endswith("\n<h1>Title</h1>\n<p>x</p>" + HTML_FOOTER)
+
+
+def test_flush_missing_file():
+    with tempfile.TemporaryDirectory() as folder:
+        fname = os.path.join(folder, "test.html")
+        document = HTMLDocument(fname, title="Title", autoflush=True)
+        document.add_paragraph("x")
+        os.remove(fname)
+
+        try:
+            document.add_paragraph("y")
+            assert False, "Appending to a removed file must fail."
+        except RuntimeError:
+            pass
+        assert not os.path.exists(fname)
+
+
+if __name__ == "__main__":
+    test_flush()
+    test_flush_footer_mismatch()
+    test_flush_failed_write()
+    test_flush_missing_file()
@@ -0,0 +1,175 @@
+import base64
+import os
+import tempfile
+import cv2
+import numpy as np
+
+from simple_md.embed_images import embed_images, _display_scale
+
+
+DATA_URL = "data:image/png;base64,iVBORw0KGgo="
+
+
+def _write_images(folder: str) -> bytes:
+    image = np.zeros((8, 12, 3), dtype=np.uint8)
+    image[:, :6] = (255, 0, 0)
+    cv2.imwrite(os.path.join(folder, "a.png"), image)
+    cv2.imwrite(os.path.join(folder, "b.jpg"), image)
+    cv2.imwrite(os.path.join(folder, "unused.png"), image)
+    with open(os.path.join(folder, "b.jpg"), "rb") as f:
+        return f.read()
+
+
+def _data_url(encoding: str, data: bytes) -> str:
+    return f"data:image/{encoding};base64,{base64.b64encode(data).decode('ascii')}"
+
+
+def test_embed_images():
+    with tempfile.TemporaryDirectory() as folder:
+        b_jpg = _write_images(folder)
+        fname = os.path.join(folder, "test.md")
+        with open(fname, "w") as f:
+            f.write("# Images\n"
+                    "![first](a.png) and ![again](a.png)\n"
+                    "<img style='width:50%' src=\"b.jpg\" />\n"
+                    f"<image src='{DATA_URL}' />\n"
+                    "Text after the images.\n")
+
+        embed_images(fname)
+
+        with open(fname, "r") as f:
+            lines = f.read().split("\n")
+        assert lines[0] == "# Images"
+        # Markdown images become html tags, the repeated image uses the same data.
+        prefix = "<img src='data:image/jpg;base64,"
+        first, again = lines[1].split(" and ")
+        assert first.startswith(prefix) and first.endswith("' />")
+        assert again == first
+        encoded = base64.b64decode(first[len(prefix):-len("' />")])
+        image = cv2.imdecode(np.frombuffer(encoded, dtype=np.uint8), cv2.IMREAD_COLOR)
+        assert image.shape == (8, 12, 3)
+        # A jpeg is embedded as it is, the tag keeps its quotes and attributes.
+        assert lines[2] == f"<img style='width:50%' src=\"{_data_url('jpg', b_jpg)}\" />"
+        assert lines[3] == f"<image src='{DATA_URL}' />"
+        assert lines[4] == "Text after the images."
+        assert sorted(os.listdir(folder)) == ["test.md", "unused.png"]
+
+
+def test_embed_images_without_images():
+    with tempfile.TemporaryDirectory() as folder:
+        _write_images(folder)
+        fname = os.path.join(folder, "test.md")
+        text = f"# No images\nSee [a link](a.png).\n<image src='{DATA_URL}' />\n"
+        with open(fname, "w") as f:
+            f.write(text)
+
+        embed_images(fname)
+
+        with open(fname, "r") as f:
+            assert f.read() == text
+        assert sorted(os.listdir(folder)) == ["a.png", "b.jpg", "test.md", "unused.png"]
+
+
+def test_display_scale():
+    assert _display_scale(b"<img src='a.png' />") == 1
+    assert _display_scale(b"<img style='width:20%' src='a.png' />") == 4
+    assert _display_scale(b"<img style='width: 50%' src='a.png' />") == 2
+    assert _display_scale(b"<img style='width:100%' src='a.png' />") == 1
+    # Only the width property counts, not min-width or max-width.
+    assert _display_scale(b"<img style='min-width:20%; width:100%' src='a.png' />") == 1
+    assert _display_scale(b"<img style='max-width:20%' src='a.png' />") == 1
+
+
+def test_embed_images_backup():
+    with tempfile.TemporaryDirectory() as folder:
+        b_jpg = _write_images(folder)
+        fname = os.path.join(folder, "test.md")
+        text = "![first](a.png)\n<img src='b.jpg' />\n"
+        with open(fname, "w") as f:
+            f.write(text)
+
+        embed_images(fname, backup=True)
+
+        backup_folder = os.path.join(folder, "backup", "0001")
+        assert sorted(os.listdir(folder)) == ["backup", "test.md", "unused.png"]
+        assert sorted(os.listdir(backup_folder)) == ["a.png", "b.jpg", "test.md"]
+        with open(os.path.join(backup_folder, "test.md"), "r") as f:
+            assert f.read() == text
+        with open(os.path.join(backup_folder, "b.jpg"), "rb") as f:
+            assert f.read() == b_jpg
+
+
+def test_embed_images_backup_same_names():
+    with tempfile.TemporaryDirectory() as folder:
+        for subfolder, value in [("x", 50), ("y", 200)]:
+            os.mkdir(os.path.join(folder, subfolder))
+            cv2.imwrite(os.path.join(folder, subfolder, "p.png"), np.full((4, 4, 3), value, dtype=np.uint8))
+        fname = os.path.join(folder, "test.md")
+        with open(fname, "w") as f:
+            f.write("![x](x/p.png) ![y](y/p.png)\n")
+
+        embed_images(fname, backup=True)
+
+        for subfolder, value in [("x", 50), ("y", 200)]:
+            image = cv2.imread(os.path.join(folder, "backup", "0001", subfolder, "p.png"))
+            assert (image == value).all()
+            assert not os.path.exists(os.path.join(folder, subfolder, "p.png"))
+
+
+def test_embed_images_backup_outside():
+    with tempfile.TemporaryDirectory() as folder:
+        b_jpg = _write_images(folder)
+        os.mkdir(os.path.join(folder, "doc"))
+        fname = os.path.join(folder, "doc", "y.md")
+        with open(fname, "w") as f:
+            f.write("![outside](../b.jpg)\n")
+
+        embed_images(fname, backup=True)
+
+        image = os.path.abspath(os.path.join(folder, "b.jpg"))
+        drive, image_path = os.path.splitdrive(image)
+        backup_image = os.path.join(folder, "doc", "backup", "0001", "external",
+                                    drive.replace(":", ""), image_path.lstrip("\\/"))
+        with open(backup_image, "rb") as f:
+            assert f.read() == b_jpg
+        assert not os.path.exists(image)
+
+
+def test_embed_images_backup_twice():
+    with tempfile.TemporaryDirectory() as folder:
+        _write_images(folder)
+        fname = os.path.join(folder, "test.md")
+        with open(fname, "w") as f:
+            f.write("![first](a.png)\n")
+        embed_images(fname, backup=True)
+        with open(fname, "r") as f:
+            text = f.read()
+        # New images are added after the first run, e.g. by another flush.
+        with open(fname, "a") as f:
+            f.write("![second](b.jpg)\n")
+        with open(fname, "r") as f:
+            second_text = f.read()
+
+        embed_images(fname, backup=True)
+
+        backup_folder = os.path.join(folder, "backup")
+        assert sorted(os.listdir(backup_folder)) == ["0001", "0002"]
+        assert sorted(os.listdir(os.path.join(backup_folder, "0001"))) == ["a.png", "test.md"]
+        assert sorted(os.listdir(os.path.join(backup_folder, "0002"))) == ["b.jpg", "test.md"]
+        with open(os.path.join(backup_folder, "0001", "test.md"), "r") as f:
+            assert f.read() == "![first](a.png)\n"
+        with open(os.path.join(backup_folder, "0002", "test.md"), "r") as f:
+            assert f.read() == second_text
+        with open(fname, "r") as f:
+            assert f.read().startswith(text)
+        assert sorted(os.listdir(folder)) == ["backup", "test.md", "unused.png"]
+
+
+if __name__ == "__main__":
+    test_embed_images()
+    test_embed_images_without_images()
+    test_display_scale()
+    test_embed_images_backup()
+    test_embed_images_backup_same_names()
+    test_embed_images_backup_outside()
+    test_embed_images_backup_twice()